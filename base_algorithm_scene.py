@@ -1,3 +1,6 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from manim import *
 
 # ===== 共用字型與顏色設定（與具體演算法邏輯解耦） =====
@@ -13,12 +16,36 @@ SORTED_COLOR = GRAY_B
 
 PANEL_STROKE = GRAY_C
 PSEUDO_FONT_SIZE = 28
+PC_HIGHLIGHT_BUFF = 0.08  # pseudocode 高亮框與文字的間距
 INFO_FONT_SIZE = 28
 
 # 統一控制每個步驟的停頓時間（秒）
 STEP_WAIT = 2.0   # 一般步驟暫停時間
 SHORT_WAIT = 0.75  # 短暫停頓
 
+# info panel 文字快取：相同內容只做一次 Pango 排版，之後回傳 copy()
+TEXT_CACHE_SIZE = 128
+_TEXT_CACHE: "OrderedDict[tuple, Text]" = OrderedDict()
+
+
+def _make_text(content: str, font_size: float) -> Text:
+    """建立 info panel 用的 Text；命中快取時複製既有物件（LRU，最多 TEXT_CACHE_SIZE 筆）。"""
+    key = (content, font_size, INFO_FONT)
+    cached = _TEXT_CACHE.get(key)
+    if cached is None:
+        cached = Text(
+            content,
+            font=INFO_FONT,
+            font_size=font_size,
+            line_spacing=0.5,
+        )
+        _TEXT_CACHE[key] = cached
+        if len(_TEXT_CACHE) > TEXT_CACHE_SIZE:
+            _TEXT_CACHE.popitem(last=False)
+    else:
+        _TEXT_CACHE.move_to_end(key)
+    return cached.copy()
+
 
 class BaseAlgorithmScene(Scene):
     """
@@ -47,6 +74,7 @@ class BaseAlgorithmScene(Scene):
       - self._pc_clear_highlight()
       - self._info_push(message)
       - self._fit_into_panel(mobject, panel, pad)
+      - self._pointer_target_points_batch(pointers, targets, buff)
       - self.pseudo_panel / self.anim_panel / self.info_panel
       - self.pseudocode_group  (Paragraph)
     """
@@ -62,9 +90,13 @@ class BaseAlgorithmScene(Scene):
         # 2) 建立三大 panel 版面
         self._create_layout()
 
-        # 3) 建立左側 pseudocode
+        # 3) 建立左側 pseudocode；同時在背景先排版 info panel 的 placeholder 文字
+        #    （兩者互不相依，placeholder 會進入 _TEXT_CACHE，步驟 5 直接取用）
         code_lines = self.get_pseudocode_lines()
-        self._build_pseudocode(code_lines)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            placeholder = pool.submit(_make_text, ".", INFO_FONT_SIZE)
+            self._build_pseudocode(code_lines)
+            placeholder.result()
 
         # 4) 讓子類別在動畫 panel 放初始物件（若需要）
         self.setup_animation_panel()
@@ -122,9 +154,20 @@ class BaseAlgorithmScene(Scene):
         GAP_COL = 0.6
         GAP_ROW_RIGHT = 0.4
         PANEL_PAD = 0.28
+        pseudo_radius, info_radius = 0.5, 0.35
+
+        # 若過寬則先以比例縮小 panel 的尺寸，直接建立最終大小的 panel（不需事後 scale 整個版面）；
+        # 文字在 panel 建立後才產生，字級維持不變
+        k = self._compute_layout_scale(pseudo_width + GAP_COL + max(anim_width, info_width))
+        if k < 1.0:
+            pseudo_width, pseudo_height = pseudo_width * k, pseudo_height * k
+            anim_width, anim_height = anim_width * k, anim_height * k
+            info_width, info_height = info_width * k, info_height * k
+            GAP_COL, GAP_ROW_RIGHT = GAP_COL * k, GAP_ROW_RIGHT * k
+            pseudo_radius, info_radius = pseudo_radius * k, info_radius * k
 
         self.pseudo_panel = RoundedRectangle(
-            corner_radius=0.5,
+            corner_radius=pseudo_radius,
             width=pseudo_width,
             height=pseudo_height,
             color=PANEL_STROKE,
@@ -133,7 +176,7 @@ class BaseAlgorithmScene(Scene):
             width=anim_width, height=anim_height, color=PANEL_STROKE
         )
         self.info_panel = RoundedRectangle(
-            corner_radius=0.35,
+            corner_radius=info_radius,
             width=info_width,
             height=info_height,
             color=PANEL_STROKE,
@@ -146,15 +189,17 @@ class BaseAlgorithmScene(Scene):
             RIGHT, buff=GAP_COL
         )
 
-        # 置中，若過寬則縮放
+        # 置中
         full_layout.move_to(ORIGIN)
-        max_width = config.frame_width - 0.6
-        if full_layout.width > max_width:
-            full_layout.scale(max_width / full_layout.width)
 
         self.add(full_layout)
         self._panel_pad = PANEL_PAD
 
+    def _compute_layout_scale(self, total_width: float) -> float:
+        """版面總寬超過畫面寬度時的縮小比例（只縮小不放大）。"""
+        max_width = config.frame_width - 0.6
+        return min(1.0, max_width / total_width)
+
     # ===================== left: pseudocode =====================
     def _build_pseudocode(self, code_lines: list[str]):
         """
@@ -171,6 +216,14 @@ class BaseAlgorithmScene(Scene):
         para.align_to(self.pseudo_panel, LEFT).shift(RIGHT * self._panel_pad)
         self._fit_into_panel(para, self.pseudo_panel, pad=self._panel_pad)
 
+        # 每行的中心 / 寬 / 高只算一次（各自一個陣列），供高亮框直接查表；寬度近乎 0 的視為空行
+        lines = para.submobjects
+        self._line_centers = np.array([line.get_center() for line in lines])
+        self._line_widths = np.array([line.width for line in lines])
+        self._line_heights = np.array([line.height for line in lines])
+        nonempty = np.flatnonzero(self._line_widths > 0.01)
+        self._first_nonempty = int(nonempty[0]) if nonempty.size else 0
+
         self.pseudocode_group = para
         self.add(self.pseudocode_group)
         self._init_pseudocode_highlighter()
@@ -179,14 +232,10 @@ class BaseAlgorithmScene(Scene):
     def _init_info_panel(self):
         """建立 info_text 物件，往後只更新內容。"""
         self.info_lines = []  # 累積目前要顯示的多行文字
-        # 使用非空字元作為 placeholder 避免 Manim 0.19 空字串崩潰
-        self.info_text = Text(
-            ".",
-            font=INFO_FONT,
-            font_size=INFO_FONT_SIZE,
-            line_spacing=0.5,
-        )
-        self.info_text.set_opacity(0)  # 先隱藏
+        # info panel 內框尺寸在版面建立後不再變動，先算好供 shrink-to-fit 使用
+        self._info_inner_w = self.info_panel.width - 2 * self._panel_pad
+        self._info_inner_h = self.info_panel.height - 2 * self._panel_pad
+        # 由 _layout_info_text 建立隱藏的 "." placeholder（避免 Manim 0.19 空字串崩潰）
         self._layout_info_text(initial=True)
 
     def _layout_info_text(self, initial: bool = False):
@@ -195,20 +244,13 @@ class BaseAlgorithmScene(Scene):
         is_empty = raw.strip() == ""
         content = raw if not is_empty else "."
 
-        new_obj = Text(
-            content,
-            font=INFO_FONT,
-            font_size=INFO_FONT_SIZE,
-            line_spacing=0.5,
-        )
+        new_obj = _make_text(content, INFO_FONT_SIZE)
         if is_empty:
             new_obj.set_opacity(0)
 
         # shrink-to-fit within the panel inner box（只縮小不放大）
-        max_w = self.info_panel.width - 2 * self._panel_pad
-        max_h = self.info_panel.height - 2 * self._panel_pad
         scale = 1.0
-        scale = min(scale, max_w / new_obj.width, max_h / new_obj.height)
+        scale = min(scale, self._info_inner_w / new_obj.width, self._info_inner_h / new_obj.height)
         new_obj.scale(scale)
 
         # 放在 info panel 內的左上角
@@ -219,14 +261,18 @@ class BaseAlgorithmScene(Scene):
             self.info_text = new_obj
             self.add(self.info_text)
         else:
-            self.play(ReplacementTransform(self.info_text, new_obj), run_time=0.25)
+            # 文字整段替換，交叉淡入淡出即可，不需逐條路徑插值
+            self.play(FadeOut(self.info_text), FadeIn(new_obj), run_time=0.25)
             self.info_text = new_obj
 
     def _info_push(self, message: str):
         """
         顯示目前步驟的說明：
           - message: 描述「現在」演算法在做什麼
+        若內容與目前顯示的相同，則不重新排版也不播放動畫。
         """
+        if self.info_lines == [message]:
+            return
         self.info_lines = [message]
         self._layout_info_text()
 
@@ -297,20 +343,49 @@ class BaseAlgorithmScene(Scene):
         - buff   : 指標尖端與 target 之間的額外距離
         """
         position = getattr(pointer, "pointer_position", "bottom")
-        triangle = getattr(pointer, "pointer_triangle", pointer.submobjects[0] if pointer.submobjects else pointer)
 
         if position == "bottom":
             anchor_point = target.get_bottom()
-            pointer_tip = triangle.get_top()
             direction = DOWN
         else:
             anchor_point = target.get_top()
-            pointer_tip = triangle.get_bottom()
             direction = UP
 
         # pointer 的中心與尖端之間的向量，移動時需加回來
-        offset = pointer.get_center() - pointer_tip
-        return anchor_point + direction * buff + offset
+        return anchor_point + direction * buff + self._pointer_tip_offset(pointer)
+
+    def _pointer_tip_offset(self, pointer: VGroup) -> np.ndarray:
+        """
+        回傳指標中心與尖端之間的向量。
+        每次都從目前的三角形即時計算：指標（或包含它的群組）被縮放後，向量也會跟著改變。
+        """
+        position = getattr(pointer, "pointer_position", "bottom")
+        triangle = getattr(pointer, "pointer_triangle", pointer.submobjects[0] if pointer.submobjects else pointer)
+        pointer_tip = triangle.get_top() if position == "bottom" else triangle.get_bottom()
+        return pointer.get_center() - pointer_tip
+
+    def _pointer_target_points_batch(
+        self, pointers: list[VGroup], targets: list[Mobject], buff: float = 0.2
+    ) -> np.ndarray:
+        """
+        一次計算多個指標的目標中心座標（例如同一步同時移動 i、j 指標），
+        回傳 shape 為 (n, 3) 的陣列，第 k 列對應 pointers[k] 指向 targets[k]。
+
+        範例：
+            i_dest, j_dest = self._pointer_target_points_batch([i_ptr, j_ptr], [boxes[i], boxes[j]])
+            self.play(i_ptr.animate.move_to(i_dest), j_ptr.animate.move_to(j_dest))
+        """
+        if not pointers:
+            return np.zeros((0, 3))
+        is_bottom = np.array(
+            [getattr(p, "pointer_position", "bottom") == "bottom" for p in pointers]
+        )
+        anchors = np.asarray(
+            [t.get_bottom() if b else t.get_top() for t, b in zip(targets, is_bottom)]
+        )
+        directions = np.where(is_bottom[:, None], DOWN, UP)
+        offsets = np.asarray([self._pointer_tip_offset(p) for p in pointers])
+        return anchors + directions * buff + offsets
 
     def _move_pointer_to(self, pointer: VGroup, target: Mobject, buff: float = 0.2):
         """
@@ -322,16 +397,11 @@ class BaseAlgorithmScene(Scene):
     # ===================== pseudocode highlighter =====================
     def _init_pseudocode_highlighter(self):
         """建立一個可重用的矩形，用來高亮目前 pseudocode 行。"""
-        # 找第一個非空行作為初始 anchor
-        initial_idx = 0
-        for idx, line in enumerate(self.pseudocode_group.submobjects):
-            if line.width > 0.01:
-                initial_idx = idx
-                break
-        target = self.pseudocode_group[initial_idx]
+        # 以第一個非空行作為初始 anchor；之後只移動 / 伸縮同一個矩形
+        target = self.pseudocode_group[self._first_nonempty]
         self.pseudo_highlight = SurroundingRectangle(
             target,
-            buff=0.08,
+            buff=PC_HIGHLIGHT_BUFF,
             color=YELLOW,
             fill_opacity=0.18,
             stroke_width=2,
@@ -345,26 +415,28 @@ class BaseAlgorithmScene(Scene):
         if (
             line_index < 0
             or self.pseudocode_group is None
-            or line_index >= len(self.pseudocode_group.submobjects)
+            or line_index >= len(self._line_widths)
         ):
             return
 
-        target = self.pseudocode_group[line_index]
-        new_rect = SurroundingRectangle(
-            target,
-            buff=0.08,
-            color=YELLOW,
-            fill_opacity=0.18,
-            stroke_width=2,
-        )
+        center = self._line_centers[line_index]
+        width = self._line_widths[line_index] + 2 * PC_HIGHLIGHT_BUFF
+        height = self._line_heights[line_index] + 2 * PC_HIGHLIGHT_BUFF
         if self._current_pc_idx is None:
             # 第一次顯示
-            self.pseudo_highlight.become(new_rect)
+            self.pseudo_highlight.stretch_to_fit_width(width)
+            self.pseudo_highlight.stretch_to_fit_height(height)
+            self.pseudo_highlight.move_to(center)
             # 只恢復描邊與半透明填色，避免把文字整個蓋住
             self.pseudo_highlight.set_fill(opacity=0.18)
             self.pseudo_highlight.set_stroke(opacity=1)
         else:
-            self.play(Transform(self.pseudo_highlight, new_rect), run_time=run_time)
+            self.play(
+                self.pseudo_highlight.animate.stretch_to_fit_width(width)
+                .stretch_to_fit_height(height)
+                .move_to(center),
+                run_time=run_time,
+            )
         self._current_pc_idx = line_index
 
     def _pc_clear_highlight(self):
@@ -0,0 +1,59 @@
+"""
+LLM 回應磁碟快取
+
+以 SHA-256(種類 + 模型 + 提示詞) 為鍵，將 LLM 回傳的結果（程式碼、視覺設計 JSON）以 zlib 壓縮後存到 LLM_CACHE_DIR。
+同樣的輸入再次執行時可直接讀取，不必重新呼叫 API。
+若需要強制重新生成，刪除 LLM_CACHE_DIR 目錄即可。
+"""
+
+import hashlib
+import os
+import zlib
+from typing import Optional
+
+LLM_CACHE_DIR = ".llm_cache"
+
+
+def make_key(kind: str, model_name: str, prompt: str) -> str:
+    """建立快取鍵；kind 區分呼叫種類（例如 "gen"、"fix"、"metaphor"）。"""
+    digest = hashlib.sha256()
+    for part in (kind, model_name, prompt):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(LLM_CACHE_DIR, f"{key}.z")
+
+
+def get(key: str) -> Optional[str]:
+    """讀取快取；不存在或無法讀取時回傳 None。"""
+    try:
+        with open(_cache_path(key), "rb") as f:
+            return zlib.decompress(f.read()).decode("utf-8")
+    except (OSError, zlib.error, UnicodeDecodeError):
+        return None
+
+
+def put(key: str, value: str) -> None:
+    """寫入快取（先寫暫存檔再取代，避免留下寫到一半的檔案）；失敗時只印出警告。"""
+    path = _cache_path(key)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(value.encode("utf-8")))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"警告：寫入 LLM 快取失敗（{path}）：{e}")
+
+
+def discard(key: str) -> None:
+    """刪除一筆快取（例如事後發現內容無法使用）；不存在時直接略過。"""
+    try:
+        os.remove(_cache_path(key))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"警告：刪除 LLM 快取失敗（{_cache_path(key)}）：{e}")
@@ -1,15 +1,63 @@
+import asyncio
 import os
 import re
-from typing import Optional
+import unicodedata
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
 
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+import llm_cache
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
 # 載入 .env 以取得 GOOGLE_API_KEY
 load_dotenv()
 
 API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# 生成程式碼中 AlgorithmAnimation 類別定義（需位於行首，註解或字串中的文字不算）
+SCENE_CLASS_NAME = "AlgorithmAnimation"
+_SCENE_CLASS_RE = re.compile(rf"^class\s+{SCENE_CLASS_NAME}\b", re.MULTILINE)
+
+# genai.configure 只需執行一次
+_configured = False
+
+# 可接受的程式碼區塊語言標記（``` 後方到換行為止的文字），依優先順序排列
+_CODE_FENCE_LANGS = ("python", "py", "")
+
+
+def _scan_fenced(text: str) -> Optional[tuple[int, int]]:
+    """
+    找出程式碼區塊內容的 (start, end) 位置；優先回傳第一個 ```python 區塊，其次 ```py，
+    最後才是第一個沒有語言標記的 ``` 區塊；都找不到則回傳 None。
+    逐一走訪每個區塊（開頭 fence 到結尾 fence），其他語言的區塊會整段跳過，
+    不會把它的結尾 ``` 誤認成新區塊的開頭。只用 str.find 向前掃描，不經過 regex 引擎。
+    """
+    found: dict[str, tuple[int, int]] = {}
+    start = text.find("```")
+    while start != -1:
+        line_end = text.find("\n", start + 3)
+        if line_end == -1:
+            break
+        body_start = line_end + 1
+        end = text.find("\n```", body_start)
+        if end == -1:
+            break
+        lang = text[start + 3:line_end]
+        if lang in _CODE_FENCE_LANGS:
+            if lang == _CODE_FENCE_LANGS[0]:
+                return body_start, end
+            found.setdefault(lang, (body_start, end))
+        # 跳過這個區塊的結尾 fence，再找下一個區塊
+        start = text.find("```", end + 4)
+
+    for lang in _CODE_FENCE_LANGS[1:]:
+        if lang in found:
+            return found[lang]
+    return None
+
 
 def _extract_code_block(text: str) -> str:
     """從回覆文字中擷取第一個 Python 程式碼區塊；若找不到則回傳原文去除首尾空白。
@@ -18,16 +66,66 @@ def _extract_code_block(text: str) -> str:
     if not text:
         return ""
 
-    patterns = [
-        r"```python\n([\s\S]*?)\n```",
-        r"```py\n([\s\S]*?)\n```",
-        r"```\n([\s\S]*?)\n```",
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, text, flags=re.MULTILINE)
-        if match:
-            return match.group(1).strip()
-    return text.strip()
+    span = _scan_fenced(text)
+    if span is None:
+        return text.strip()
+    return text[span[0]:span[1]].strip()
+
+
+def has_scene_class(code: Optional[str]) -> bool:
+    """檢查 LLM 回傳的程式碼是否定義了 AlgorithmAnimation 類別。"""
+    return bool(code) and _SCENE_CLASS_RE.search(code) is not None
+
+
+_TRAILING_WS_PATTERN = re.compile(r"[ \t]+\n")
+
+
+def _canonicalize_prompt(prompt: str) -> str:
+    """去除行尾空白並做 NFC 正規化，讓內容相同的提示詞送出時逐位元組相同。"""
+    return unicodedata.normalize("NFC", _TRAILING_WS_PATTERN.sub("\n", prompt))
+
+
+def _ensure_configured() -> None:
+    """首次呼叫時設定 API 金鑰，之後直接略過。"""
+    global _configured
+    if not _configured:
+        # 延後載入 SDK，讓 CLI 啟動時不必先載入整個 google.generativeai
+        import google.generativeai as genai
+
+        genai.configure(api_key=API_KEY)
+        _configured = True
+
+
+@lru_cache(maxsize=8)
+def get_model(model_name: str) -> "genai.GenerativeModel":
+    """依模型名稱重用同一個 GenerativeModel，避免每次呼叫都重新建立。"""
+    import google.generativeai as genai
+
+    _ensure_configured()
+    return genai.GenerativeModel(model_name)
+
+
+@lru_cache(maxsize=8)
+def _read_file_cached(path: str, mtime: float) -> str:
+    """讀取文字檔；以 (path, mtime) 為快取鍵，檔案修改後 mtime 改變即自動重新讀取。"""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def read_prompt_file(path: str) -> str:
+    """
+    讀取提示詞模板 / Base Class 等文字檔，未變動時直接回傳快取內容。
+    讀取失敗時照常拋出 FileNotFoundError / OSError，由呼叫端處理。
+    """
+    return _read_file_cached(path, os.path.getmtime(path))
+
+
+def _finish(content_text: str, cache_key: str) -> str:
+    """從 LLM 回應擷取程式碼；只快取看起來可用的程式碼，缺少場景類別的回應下次會重新請求。"""
+    code = _extract_code_block(content_text)
+    if has_scene_class(code):
+        llm_cache.put(cache_key, code)
+    return code
 
 
 def generate_manim_code(prompt: str, model_name: str = "gemini-3-pro-preview") -> Optional[str]:
@@ -36,24 +134,69 @@ def generate_manim_code(prompt: str, model_name: str = "gemini-3-pro-preview") -
 
     :param prompt: 已經填充好的完整提示詞
     :param model_name: 預設使用 gemini-3-pro-preview，可依環境調整
-    :return: 程式碼字串；若發生錯誤回傳 None
+    :return: 程式碼字串；若發生錯誤或回應中沒有場景類別則回傳 None
+    """
+    # 與多模型併發請求共用同一份非同步實作（快取、擷取與錯誤處理只維護一處）
+    return asyncio.run(generate_first_valid_manim_code(prompt, [model_name]))
+
+
+async def _generate_manim_code_async(prompt: str, model_name: str) -> Optional[str]:
+    """向單一模型請求 Manim 程式碼（prompt 須已正規化），供 generate_first_valid_manim_code 併發呼叫。"""
+    cache_key = llm_cache.make_key("gen", model_name, prompt)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        print(f"使用快取的程式碼 (Model: {model_name})")
+        return cached
+
+    try:
+        model = get_model(model_name)
+        response = await model.generate_content_async(
+            prompt, generation_config={"temperature": 0.2}
+        )
+        # 可能回傳物件的介面會隨版本不同，這裡以 .text 取整段文字
+        return _finish(getattr(response, "text", None) or "", cache_key)
+    except Exception as e:
+        print(f"呼叫 LLM API 時發生錯誤 (Model: {model_name}): {e}")
+        return None
+
+
+async def generate_first_valid_manim_code(prompt: str, model_names: list[str]) -> Optional[str]:
+    """
+    同時向多個模型請求 Manim 程式碼（例如主模型 + 備用模型），以 asyncio.as_completed
+    取最先完成且含有場景類別的結果，其餘尚未回應的請求會被取消，不必等最慢的模型。
+
+    :param prompt: 已經填充好的完整提示詞
+    :param model_names: 要同時請求的模型名稱列表
+    :return: 第一個有效的程式碼字串；全部失敗時回傳 None
     """
     if not API_KEY:
         print("錯誤：找不到 GOOGLE_API_KEY。請在專案根目錄建立 .env 並設定 GOOGLE_API_KEY=你的金鑰。")
         return None
 
+    prompt = _canonicalize_prompt(prompt)
+    tasks = [
+        asyncio.create_task(_generate_manim_code_async(prompt, name))
+        for name in model_names
+    ]
     try:
-        genai.configure(api_key=API_KEY)
-        model = genai.GenerativeModel(model_name)
-        response = model.generate_content(prompt, generation_config={"temperature": 0.2})
-
-        # 可能回傳物件的介面會隨版本不同，這裡以 .text 取整段文字
-        content_text = getattr(response, "text", None) or ""
-        code = _extract_code_block(content_text)
-        return code
-    except Exception as e:
-        print(f"呼叫 LLM API 時發生錯誤: {e}")
+        for next_done in asyncio.as_completed(tasks):
+            code = await next_done
+            if has_scene_class(code):
+                return code
         return None
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def discard_generated_code(prompt: str, model_names: list[str]) -> None:
+    """
+    刪除這份提示詞在各模型下快取的生成結果。
+    程式碼最終仍無法渲染時呼叫，下次執行才會重新請求 LLM，而不是從磁碟重播同一串失敗的修復。
+    """
+    prompt = _canonicalize_prompt(prompt)
+    for name in model_names:
+        llm_cache.discard(llm_cache.make_key("gen", name, prompt))
 
 
 # ... (保留原本的 imports 和 generate_manim_code)
@@ -66,14 +209,24 @@ def fix_manim_code(broken_code: str, error_log: str, model_name: str = "gemini-3
         print("錯誤：找不到 GOOGLE_API_KEY。")
         return None
 
-    # 建構修復用的 Prompt
+    # 建構修復用的 Prompt：固定的說明在前、本次的程式碼與錯誤訊息在後，
+    # 讓每次修復請求共用相同的前綴
     prompt = f"""
     [SYSTEM]
     You are a Manim expert. The Python code you generated previously failed to execute.
     Your task is to analyze the error message and FIX the code.
 
     ---
-    
+
+    ### INSTRUCTIONS:
+    1. Identify the cause of the error (e.g., AttributeError, TypeError, SyntaxError).
+    2. Fix the code logic or syntax.
+    3. **DO NOT** change the overall structure (must inherit from BaseAlgorithmScene).
+    4. Keep every part unrelated to the error byte-for-byte identical (same class, method names and animation calls), so that Manim can reuse cached animation segments from the previous run.
+    5. Return the **COMPLETE** fixed Python code block (wrapped in ```python).
+
+    ---
+
     ### BROKEN CODE:
     ```python
     {broken_code}
@@ -81,27 +234,24 @@ def fix_manim_code(broken_code: str, error_log: str, model_name: str = "gemini-3
 
     ### EXECUTION ERROR (stderr):
     {error_log}
-
-    ---
-
-    ### INSTRUCTIONS:
-    1. Identify the cause of the error (e.g., AttributeError, TypeError, SyntaxError).
-    2. Fix the code logic or syntax. 
-    3. **DO NOT** change the overall structure (must inherit from BaseAlgorithmScene).
-    4. Return the **COMPLETE** fixed Python code block (wrapped in ```python).
     """
 
+    # 同一份程式碼 + 同一段錯誤訊息曾修復過，直接沿用
+    prompt = _canonicalize_prompt(prompt)
+    cache_key = llm_cache.make_key("fix", model_name, prompt)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        print(f"使用快取的修復程式碼 (Model: {model_name})")
+        return cached
+
     try:
         # 使用與原本相同的配置，建議使用較聰明的模型來進行 Debug
-        genai.configure(api_key=API_KEY)
-        model = genai.GenerativeModel(model_name)
+        model = get_model(model_name)
         
         print(f"正在請求 AI 修復程式碼 (Model: {model_name})...")
         response = model.generate_content(prompt, generation_config={"temperature": 0.2})
 
-        content_text = getattr(response, "text", None) or ""
-        fixed_code = _extract_code_block(content_text)
-        return fixed_code
+        return _finish(getattr(response, "text", None) or "", cache_key)
     except Exception as e:
         print(f"呼叫 LLM Fix API 時發生錯誤: {e}")
         return None
\ No newline at end of file
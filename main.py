@@ -1,13 +1,27 @@
+import ast
+import atexit
+import asyncio
+import codecs
+import json
+import multiprocessing
 import os
 import sys
-import glob
 import subprocess
-import shutil
 import re
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from llm_client import generate_manim_code, fix_manim_code
-from visual_metaphor_designer import generate_visual_metaphor
+from llm_client import (
+    discard_generated_code,
+    fix_manim_code,
+    generate_first_valid_manim_code,
+    has_scene_class,
+    read_prompt_file,
+)
+import semantic_cache
 
 # 模板模式常數
 TEMPLATE_MODE_FULL = "full"
@@ -25,13 +39,67 @@ BASE_CLASS_SIMPLE = "simple_animation_scene.py"
 GENERATED_CODE_PATH = "generated_algo_scene.py"
 MANIM_CLASS_NAME = "AlgorithmAnimation"
 
+# 傳給 Manim 子程序的輸入資料 sidecar 檔（需與 simple_animation_scene.INPUT_SIDECAR_PATH 一致）
+INPUT_SIDECAR_PATH = ".algo_input.json"
+
+# Manim 輸出影片目錄；-ql 渲染的影片位於其下的 480p15
+VIDEO_OUTPUT_DIR = os.path.join("media", "videos", "generated_algo_scene")
+RENDER_QUALITY_DIR = "480p15"
+
+# 產生程式碼時同時請求的模型（可加入備用模型，以併發方式一起呼叫）
+CODE_GENERATION_MODELS = ["gemini-3-pro-preview"]
+
+# Manim 只輸出 WARNING 以上的日誌（錯誤 traceback 仍會寫入 stderr）
+MANIM_LOG_ARGS = ["-v", "WARNING"]
+
+# 渲染後自動預覽；與畫質旗標分開傳入（-p -ql），所有版本的 Manim CLI 都支援，
+# 不必依版本偵測是否接受合併寫法 -pql
+MANIM_PREVIEW_ARGS = ["-p"]
+
 # 設定最大自動修復次數
 MAX_RETRIES = 3
 
+# 連續請求 LLM 修復之間的退避上限（秒）：第 n 次修正前等待 min(2**n, 上限)
+FIX_BACKOFF_MAX_SECONDS = 8
+
+# 環境問題造成、LLM 改程式碼也無法修好的錯誤；遇到時直接停止自動修復
+_UNFIXABLE_ERROR_PATTERN = re.compile(
+    r"ModuleNotFoundError: No module named 'manim'"
+    r"|ffmpeg.*not found"
+    r"|No such file or directory: '(?:ffmpeg|latex|dvisvgm)'"
+    r"|MemoryError"
+    r"|CUDA out of memory"
+)
+
+# 串流 Manim stderr 時保留的最後行數（傳給 LLM 修復與錯誤紀錄）
+STDERR_TAIL_LINES = 200
+
+# 常駐 Manim worker 啟動（載入 manim）的最長等待秒數；逾時或失敗則改用 manim 子程序
+RENDER_WORKER_START_TIMEOUT = 60
+
+# 常駐 worker 單次渲染的最長等待秒數；逾時視為渲染失敗，並重新啟動 worker
+RENDER_TIMEOUT = 600
+
 # 錯誤紀錄目錄
 ERROR_LOG_DIR = "error_logs"
 
 
+# 前綴快取的最小 token 數，以及粗估用的每 token 字元數
+MIN_CACHEABLE_PREFIX_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+
+# slugify_algorithm_name 使用的 pattern
+_RE_WS = re.compile(r"\s+")
+_RE_NONSLUG = re.compile(r"[^a-z0-9_]+")
+
+# 提示詞模板中的 {{placeholder}}
+_PLACEHOLDER_PATTERN = re.compile(r"\{\{(\w+)\}\}")
+
+# 錯誤紀錄寫檔用的背景執行緒（單一 worker，依提交順序寫入）
+_LOG_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+atexit.register(_LOG_EXECUTOR.shutdown, wait=True)
+
+
 def ensure_error_log_dir() -> None:
     """確保錯誤紀錄目錄存在。"""
     os.makedirs(ERROR_LOG_DIR, exist_ok=True)
@@ -44,9 +112,9 @@ def slugify_algorithm_name(name: str) -> str:
     """
     name = (name or "").strip().lower()
     # 先把空白轉成底線
-    name = re.sub(r"\s+", "_", name)
+    name = _RE_WS.sub("_", name)
     # 再移除非 a-z0-9_ 的字元
-    name = re.sub(r"[^a-z0-9_]+", "", name)
+    name = _RE_NONSLUG.sub("", name)
     return name or "algorithm"
 
 
@@ -59,24 +127,31 @@ def save_error_snapshot(
     會在 ERROR_LOG_DIR 底下產生兩個檔案：
       - {slug}_{timestamp}_attempt{n}.py
       - {slug}_{timestamp}_attempt{n}.log
+
+    檔名在呼叫當下決定；兩個檔案合併成一個工作交給背景執行緒寫入，
+    不會擋住接下來的 LLM 修復請求。程式正常結束前會等待所有寫入完成。
     """
-    ensure_error_log_dir()
     slug = slugify_algorithm_name(algorithm_name)
     ts = datetime.now().strftime("%Y%m%dT%H%M%S")
     base_name = f"{slug}_{ts}_attempt{attempt_index}"
+    _LOG_EXECUTOR.submit(_write_error_snapshot, base_name, code or "", stderr or "")
+
 
+def _write_error_snapshot(base_name: str, code: str, stderr: str) -> None:
+    """save_error_snapshot 的實際寫檔工作（在背景執行緒執行）。"""
+    ensure_error_log_dir()
     code_path = os.path.join(ERROR_LOG_DIR, f"{base_name}.py")
     log_path = os.path.join(ERROR_LOG_DIR, f"{base_name}.log")
 
     try:
         with open(code_path, "w", encoding="utf-8") as f:
-            f.write(code or "")
+            f.write(code)
     except OSError as e:
         print(f"警告：儲存錯誤程式碼失敗（{code_path}）：{e}")
 
     try:
         with open(log_path, "w", encoding="utf-8") as f:
-            f.write(stderr or "")
+            f.write(stderr)
     except OSError as e:
         print(f"警告：儲存錯誤日誌失敗（{log_path}）：{e}")
 
@@ -101,7 +176,21 @@ def main():
             print("無效的選擇，請輸入 1 或 2。")
     
     algorithm_name = input("\n請輸入演算法名稱 (例如: Bubble Sort): ")
-    input_data = input("請輸入要處理的資料 (例如: [8, 2, 6, 4]): ")
+    # 只正規化一次：提示詞、相似請求快取的鍵與字面值替換都使用同一個去除空白後的輸入
+    input_data = input("請輸入要處理的資料 (例如: [8, 2, 6, 4]): ").strip()
+
+    # 相同演算法、相同結構的輸入曾成功渲染過：直接沿用程式碼，略過所有 LLM 步驟
+    cached_code = semantic_cache.lookup(algorithm_name, input_data, template_mode)
+    if cached_code is not None:
+        print("\n找到相似請求的程式碼快取，略過視覺設計與程式碼生成。")
+        if _render_and_remember(algorithm_name, input_data, template_mode, cached_code):
+            return
+        # 沿用的程式碼經自動修復仍無法渲染：丟棄這筆快取，改走完整的生成流程
+        print("\n快取的程式碼無法渲染，改為重新生成。")
+        semantic_cache.discard(algorithm_name, input_data, template_mode)
+
+    # 延後載入：讓歡迎訊息與輸入提示不必等待 LLM SDK 載入
+    from visual_metaphor_designer import generate_visual_metaphor
 
     # 【新增】生成視覺隱喻設計
     print("\n" + "=" * 50)
@@ -129,18 +218,34 @@ def main():
     print("\n" + "=" * 50)
     print("步驟 3: 使用 AI 生成 Manim 程式碼...")
     print("=" * 50)
-    generated_code = generate_manim_code(prompt)       # 使用 LLM 生成 Manim 程式碼
+    # 使用 LLM 生成 Manim 程式碼；多個模型會併發請求，取最先回應的有效結果
+    generated_code = asyncio.run(
+        generate_first_valid_manim_code(prompt, CODE_GENERATION_MODELS)
+    )
 
     # 檢查生成程式碼是否有效；若有效則進入「執行 → 報錯 → 修正 → 再執行」自動修復迴圈
-    if generated_code and "class AlgorithmAnimation" in generated_code:
+    if generated_code is not None:
         print("\n" + "=" * 50)
         print("步驟 4: 渲染動畫...")
         print("=" * 50)
-        run_with_auto_fix(algorithm_name, input_data, generated_code)
+        if not _render_and_remember(algorithm_name, input_data, template_mode, generated_code):
+            # 最終仍無法渲染：丟棄快取的生成結果，下次執行會重新請求 LLM
+            discard_generated_code(prompt, CODE_GENERATION_MODELS)
     else:
         print("\n抱歉，無法生成有效的 Manim 程式碼。請檢查您的輸入或 API 金鑰。")
 
 
+def _render_and_remember(
+    algorithm_name: str, input_data: str, template_mode: str, code: str
+) -> bool:
+    """執行自動修復渲染；成功時把最終程式碼存入相似請求快取並回傳 True。"""
+    final_code = run_with_auto_fix(algorithm_name, input_data, code)
+    if final_code is None:
+        return False
+    semantic_cache.store(algorithm_name, input_data, template_mode, final_code)
+    return True
+
+
 def build_prompt(algorithm: str, data: str, visual_metaphor, template_mode: str) -> str | None:
     """
     根據使用者輸入、視覺隱喻、模板、Base Class 原始碼組合出給 LLM 的完整提示詞。
@@ -162,8 +267,7 @@ def build_prompt(algorithm: str, data: str, visual_metaphor, template_mode: str)
     
     # 讀取提示詞模板
     try:
-        with open(prompt_template_path, "r", encoding="utf-8") as f:
-            template = f.read()
+        template = read_prompt_file(prompt_template_path)
     except FileNotFoundError:
         print(f"錯誤：找不到提示詞模板檔案：{prompt_template_path}。")
         print("請確認該檔案是否存在於專案根目錄，或檔名是否正確。")
@@ -174,8 +278,7 @@ def build_prompt(algorithm: str, data: str, visual_metaphor, template_mode: str)
 
     # 讀取 Base Class 的原始碼
     try:
-        with open(base_class_path, "r", encoding="utf-8") as f:
-            base_code = f.read()
+        base_code = read_prompt_file(base_class_path)
     except FileNotFoundError:
         print(f"錯誤：找不到 Base Class 檔案：{base_class_path}。")
         print(f"請確認該檔案是否存在於專案根目錄，或檔名是否正確。")
@@ -184,14 +287,30 @@ def build_prompt(algorithm: str, data: str, visual_metaphor, template_mode: str)
         print(f"錯誤：讀取 Base Class 檔案時發生問題：{e}")
         return None
 
-    # 將視覺隱喻轉換為 JSON 字串
-    visual_metaphor_json = visual_metaphor.to_json(indent=2)
+    # 正規化輸入，讓相同請求產生逐位元組相同的提示詞（提高前綴快取與 LLM 快取命中率）
+    algorithm = algorithm.strip()
+    data = data.strip()
+
+    # 將視覺隱喻轉換為 JSON 字串（固定鍵順序）
+    visual_metaphor_json = visual_metaphor.to_json(indent=2, sort_keys=True)
+
+    # 固定前綴（結尾 [TASK] 區段之前）太短時 Gemini 不會套用前綴快取，提醒維護者。
+    # 內文中也會提到 "[TASK]"，因此從後方尋找獨立成行的區段標題
+    prefix_chars = template.rfind("\n[TASK]\n")
+    if 0 <= prefix_chars and prefix_chars + len(base_code) < MIN_CACHEABLE_PREFIX_TOKENS * CHARS_PER_TOKEN:
+        print(f"警告：提示詞固定前綴約少於 {MIN_CACHEABLE_PREFIX_TOKENS} tokens，可能無法命中前綴快取。")
     
-    return (
-        template.replace("{{algorithm_name}}", algorithm)
-        .replace("{{user_input_data}}", data)
-        .replace("{{base_class_code}}", base_code)
-        .replace("{{visual_metaphor_json}}", visual_metaphor_json)
+    # 單次掃描替換所有 placeholder；未知的 placeholder 保持原樣。
+    # 模板中只有 {{base_class_code}} 位於前段，其餘使用者輸入都集中在結尾的 [TASK]，
+    # 同一模式下每次請求的提示詞前綴完全相同，可命中 Gemini 的前綴（implicit）快取。
+    values = {
+        "algorithm_name": algorithm,
+        "user_input_data": data,
+        "base_class_code": base_code,
+        "visual_metaphor_json": visual_metaphor_json,
+    }
+    return _PLACEHOLDER_PATTERN.sub(
+        lambda m: values.get(m.group(1), m.group(0)), template
     )
 
 
@@ -202,35 +321,34 @@ def save_code(code: str):
 
 
 def clean_previous_outputs():
-    # 刪除本場景的 partial 檔案
-    partial_dir = os.path.join(
-        "media",
-        "videos",
-        "generated_algo_scene",
-        "720p30",
-        "partial_movie_files",
-        "AlgorithmAnimation",
-    )
-    shutil.rmtree(partial_dir, ignore_errors=True)
+    """
+    清除上一次渲染留下的最終影片，避免誤把舊影片當成這次的結果。
 
-    # 如需刪除最終影片（同名場景）
-    final_mp4 = os.path.join(
-        "media", "videos", "generated_algo_scene", "720p30", "AlgorithmAnimation.mp4"
-    )
+    Manim 的快取（partial_movie_files 與 media/texts）一律保留：
+    Manim 會依動畫與物件的 hash 重用未變動的片段與文字，自動修復時只需重新渲染改動的部分。
+    """
+    final_mp4 = os.path.join(VIDEO_OUTPUT_DIR, RENDER_QUALITY_DIR, f"{MANIM_CLASS_NAME}.mp4")
     if os.path.isfile(final_mp4):
         os.remove(final_mp4)
 
-    # 如需清空文字快取（會讓文字重新渲染）
-    texts_dir = os.path.join("media", "texts")
-    shutil.rmtree(texts_dir, ignore_errors=True)
 
+def _check_syntax(code: str) -> str | None:
+    """以 ast.parse 檢查程式碼語法；通過回傳 None，否則回傳與 Python 相同格式的錯誤訊息。"""
+    try:
+        ast.parse(code, filename=GENERATED_CODE_PATH)
+    except SyntaxError as e:
+        return "".join(traceback.format_exception_only(type(e), e))
+    return None
 
-def run_with_auto_fix(algorithm_name: str, input_data: str, initial_code: str) -> None:
+
+def run_with_auto_fix(algorithm_name: str, input_data: str, initial_code: str) -> str | None:
     """
     建立「執行 → 報錯 → LLM 修正 → 再執行」的自動修復迴圈。
 
     - 會最多進行 1 + MAX_RETRIES 次嘗試（原始程式碼一次 + 最多 MAX_RETRIES 次修正版）。
     - 每次失敗都會將當前版本的程式碼與 stderr 落盤，方便事後分析。
+    - stderr 顯示為環境錯誤（缺少 manim / ffmpeg、記憶體不足）時直接停止，不再請 LLM 修正。
+    - 回傳成功渲染的那一版程式碼；全部失敗則回傳 None。
     """
     current_code = initial_code
     attempt = 0
@@ -240,124 +358,312 @@ def run_with_auto_fix(algorithm_name: str, input_data: str, initial_code: str) -
         print(f"第 {attempt + 1} 次嘗試渲染動畫…")
         print("=" * 50)
 
-        # 將目前版本程式碼寫入檔案，並清除舊的輸出
+        # 將目前版本程式碼寫入檔案
         save_code(current_code)
-        clean_previous_outputs()
 
-        # 單次嘗試執行 Manim
-        success, stderr = _render_manim_core(input_data)
+        # 先做語法檢查：語法錯誤不必啟動 Manim，直接交給 LLM 修正
+        syntax_error = _check_syntax(current_code)
+        if syntax_error is None:
+            # 清除舊的輸出，單次嘗試執行 Manim
+            clean_previous_outputs()
+            success, stderr = _render_manim_core(input_data)
+        else:
+            print("程式碼存在語法錯誤，略過 Manim 渲染。")
+            success, stderr = False, syntax_error
 
         if success:
             print(f"\nManim 渲染成功（第 {attempt + 1} 次嘗試）")
-            video = _find_latest_video()
-            if video:
-                abs_path = os.path.abspath(video)
-                print(f"動畫已生成，影片檔案位於: {abs_path}")
-                try:
-                    if sys.platform == "win32":
-                        os.startfile(video)
-                    elif sys.platform == "darwin":
-                        subprocess.run(["open", video])
-                    else:
-                        subprocess.run(["xdg-open", video])
-                except Exception:
-                    print("\n無法自動開啟影片，請手動開啟檔案。")
-            else:
-                print("找不到輸出影片檔案，請檢查 Manim 輸出目錄。")
-            break
+            _show_rendered_video()
+            return current_code
 
         # 失敗：先把這一版程式碼與錯誤訊息存起來
         print(f"\nManim 渲染失敗（第 {attempt + 1} 次嘗試）。")
         save_error_snapshot(algorithm_name, attempt, current_code, stderr or "")
 
+        # 執行環境本身的問題（缺少套件 / ffmpeg、記憶體不足），修改程式碼無濟於事
+        if stderr and _UNFIXABLE_ERROR_PATTERN.search(stderr):
+            print("偵測到無法透過修改程式碼解決的環境錯誤，停止自動修復。")
+            print("詳細錯誤訊息與對應程式碼已儲存在 error_logs 目錄中。")
+            return None
+
         # 已達最大自動修復次數（錯誤詳細內容已寫入 error_logs，不再印出 stderr）
         if attempt >= MAX_RETRIES:
             print("已達最大自動修復次數，仍無法成功渲染。")
             print("詳細錯誤訊息與對應程式碼已儲存在 error_logs 目錄中。")
-            break
+            return None
 
-        # 尚有修復次數，請 LLM 嘗試修正程式碼
+        # 尚有修復次數，請 LLM 嘗試修正程式碼；連續修復之間逐次拉長間隔，避免觸發 API 速率限制
+        if attempt > 0:
+            time.sleep(min(2 ** attempt, FIX_BACKOFF_MAX_SECONDS))
         print("嘗試使用 LLM 自動修復程式碼…")
         fixed_code = fix_manim_code(current_code, stderr or "")
 
-        if not fixed_code or "class AlgorithmAnimation" not in fixed_code:
+        if not has_scene_class(fixed_code):
             print("AI 無法提供可用的修正版程式碼，停止自動修復。")
-            break
+            return None
 
         current_code = fixed_code
         attempt += 1
 
 
+async def _pump_stream(stream: asyncio.StreamReader, sink, tail: deque | None) -> None:
+    """
+    將子程序輸出即時轉寫到終端機（sink），必要時同步保留最後幾行到 tail。
+    以固定大小的區塊讀取，Manim 以 \r 更新的進度列也能即時顯示。
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        sink.write(text)
+        sink.flush()
+        if tail is not None:
+            lines = (pending + text).splitlines(keepends=True)
+            pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+            tail.extend(lines)
+    pending += decoder.decode(b"", final=True)
+    if tail is not None and pending:
+        tail.append(pending)
+
+
+async def _stream_manim_async(cmd: list[str]) -> tuple[int, str]:
+    """
+    以 asyncio 子程序執行 manim，同時轉寫 stdout / stderr，並保留 stderr 最後幾行。
+    子程序直接繼承目前的環境變數（輸入資料改由 sidecar 檔傳遞，不需另外複製 env）。
+    """
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    await asyncio.gather(
+        _pump_stream(proc.stderr, sys.stderr, tail),
+        _pump_stream(proc.stdout, sys.stdout, None),
+    )
+    returncode = await proc.wait()
+    return returncode, "".join(tail)
+
+
+def _stream_manim(cmd: list[str]) -> tuple[int, str]:
+    """
+    執行 manim 並即時顯示渲染進度；stderr 只保留最後 STDERR_TAIL_LINES 行，
+    無論渲染多久，記憶體用量都維持固定。
+
+    回傳：
+      - returncode: 子程序結束代碼
+      - stderr_tail: stderr 最後幾行文字
+    """
+    return asyncio.run(_stream_manim_async(cmd))
+
+
+def _write_input_sidecar(input_data: str) -> None:
+    """
+    將使用者輸入寫入 INPUT_SIDECAR_PATH，供子程序中的 AlgorithmAnimation 讀取。
+
+    - 可無損轉為 JSON 的資料（list / dict[str, ...] / 數字 / 字串）以 {"format": "json"} 儲存，
+      子程序直接 json.loads，不需再以 ast.literal_eval 解析 Python 語法。
+    - 含 tuple、非字串 key 等 JSON 無法表示的資料，保留原字串（{"format": "python"}）。
+    """
+    payload = {"format": "python", "data": input_data}
+    try:
+        value = ast.literal_eval(input_data)
+        if json.loads(json.dumps(value)) == value:
+            payload = {"format": "json", "data": value}
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        pass
+    with open(INPUT_SIDECAR_PATH, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+
+
 def _run_manim(quality_flag: str, input_data: str) -> bool:
     """
-    執行 manim，並透過環境變數 ALGO_USER_INPUT_DATA
-    將使用者輸入字串傳遞給子程序中的 AlgorithmAnimation。
+    執行 manim，並透過 INPUT_SIDECAR_PATH
+    將使用者輸入傳遞給子程序中的 AlgorithmAnimation。
+
+    quality_flag 為單獨的畫質旗標（例如 "-qm"）；預覽旗標 -p 分開傳入，
+    新舊版 Manim CLI 都接受，不需要先試 -pqm 失敗再重跑一次。
     """
-    # -pqm 等同 -p -qm；若出現相容問題，改用分開旗標
-    cmd = ["manim", quality_flag, GENERATED_CODE_PATH, MANIM_CLASS_NAME]
-    alt_cmd = ["manim", "-p", "-qm", GENERATED_CODE_PATH, MANIM_CLASS_NAME]
+    _write_input_sidecar(input_data)
+
+    returncode, err = _stream_manim(
+        ["manim", *MANIM_LOG_ARGS, *MANIM_PREVIEW_ARGS, quality_flag, GENERATED_CODE_PATH, MANIM_CLASS_NAME]
+    )
+    # 成功時仍回傳可能存在的 stderr（通常為空字串）
+    return returncode == 0, err
 
-    env = os.environ.copy()
-    env["ALGO_USER_INPUT_DATA"] = input_data
 
+def _show_rendered_video() -> None:
+    """找出剛渲染好的影片，顯示路徑並以系統預設播放器開啟。"""
+    video = _find_latest_video(RENDER_QUALITY_DIR)
+    if not video:
+        print("找不到輸出影片檔案，請檢查 Manim 輸出目錄。")
+        return
+
+    abs_path = os.path.abspath(video)
+    print(f"動畫已生成，影片檔案位於: {abs_path}")
     try:
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, check=True, env=env
+        if sys.platform == "win32":
+            os.startfile(video)
+        elif sys.platform == "darwin":
+            subprocess.run(["open", video])
+        else:
+            subprocess.run(["xdg-open", video])
+    except Exception:
+        print("\n無法自動開啟影片，請手動開啟檔案。")
+
+
+def _find_latest_video(quality_dir: str | None = None) -> str | None:
+    """
+    找出最新的輸出影片。
+    若已知畫質目錄（例如 "480p15"），直接檢查該路徑；找不到時才遞迴搜尋整個輸出目錄。
+    """
+    if quality_dir:
+        direct = os.path.join(VIDEO_OUTPUT_DIR, quality_dir, f"{MANIM_CLASS_NAME}.mp4")
+        if os.path.isfile(direct):
+            return direct
+    return _scan_latest_video(VIDEO_OUTPUT_DIR)
+
+
+def _scan_latest_video(root: str) -> str | None:
+    """
+    以 os.scandir 走訪 root，邊走邊記錄 mtime 最新的 {MANIM_CLASS_NAME}.mp4；
+    partial_movie_files 內只有片段影片，直接略過不進入。
+    """
+    target = f"{MANIM_CLASS_NAME}.mp4"
+    best_path, best_mtime = None, -1.0
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != "partial_movie_files":
+                        stack.append(entry.path)
+                elif entry.name == target:
+                    mtime = entry.stat().st_mtime
+                    if mtime > best_mtime:
+                        best_path, best_mtime = entry.path, mtime
+    return best_path
+
+
+# 常駐渲染 worker：(process, connection)；尚未啟動或已停用時為 None
+_render_worker = None
+# worker 無法啟動或中途異常結束後設為 True，之後一律走 manim 子程序
+_render_worker_disabled = False
+
+
+def _start_render_worker():
+    """以 spawn 啟動 manim_worker，等待它載入 manim；失敗時回傳 None。"""
+    import manim_worker
+
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe()
+    proc = ctx.Process(
+        target=manim_worker.serve, args=(child_conn, os.getcwd()), daemon=True
+    )
+    proc.start()
+    # 關閉父程序這端的 child_conn，worker 結束時 recv 才會收到 EOFError
+    child_conn.close()
+
+    try:
+        if parent_conn.poll(RENDER_WORKER_START_TIMEOUT):
+            hello = parent_conn.recv()
+        else:
+            hello = {"ready": False, "error": "啟動逾時"}
+    except (EOFError, OSError) as e:
+        hello = {"ready": False, "error": str(e)}
+
+    if not hello.get("ready"):
+        print(f"警告：常駐 Manim worker 啟動失敗，改用 manim 子程序：{hello.get('error', '')}")
+        parent_conn.close()
+        proc.terminate()
+        return None
+    return proc, parent_conn
+
+
+def _stop_render_worker() -> None:
+    """通知 worker 結束；程式結束時由 atexit 呼叫。"""
+    global _render_worker
+    if _render_worker is None:
+        return
+    proc, conn = _render_worker
+    _render_worker = None
+    try:
+        conn.send(None)
+        conn.close()
+    except OSError:
+        pass
+    proc.join(timeout=5)
+    if proc.is_alive():
+        proc.terminate()
+
+
+atexit.register(_stop_render_worker)
+
+
+def _render_in_worker() -> tuple[bool, str] | None:
+    """
+    請常駐 worker 渲染 GENERATED_CODE_PATH。
+    worker 無法使用（啟動失敗或渲染途中異常結束）時回傳 None，由呼叫端改走子程序。
+    """
+    global _render_worker, _render_worker_disabled
+    if _render_worker_disabled:
+        return None
+    if _render_worker is None:
+        _render_worker = _start_render_worker()
+        if _render_worker is None:
+            _render_worker_disabled = True
+            return None
+
+    proc, conn = _render_worker
+    try:
+        conn.send(
+            {"file": GENERATED_CODE_PATH, "class": MANIM_CLASS_NAME, "quality": "low_quality"}
         )
-        # 成功時仍回傳可能存在的 stderr（通常為空字串）
-        return True, (result.stderr or "")
-    except subprocess.CalledProcessError as e:
-        err = e.stderr or ""
-        # 若不支援 -pqm，嘗試以 -p -qm
-        if "no such option" in err:
-            try:
-                result2 = subprocess.run(
-                    alt_cmd,
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                    env=env,
-                )
-                combined = "\n".join(
-                    part for part in (err, result2.stderr or "") if part
-                )
-                return True, combined
-            except subprocess.CalledProcessError as e2:
-                combined = "\n".join(part for part in (err, e2.stderr or "") if part)
-                return False, combined
-        return False, err
-
-
-def _find_latest_video() -> str | None:
-    pattern = os.path.join("media", "videos", "generated_algo_scene", "**", f"{MANIM_CLASS_NAME}.mp4")
-    matches = glob.glob(pattern, recursive=True)
-    if not matches:
+        if not conn.poll(RENDER_TIMEOUT):
+            # 渲染卡住（例如生成的程式碼有無窮迴圈）：結束這個 worker，下次渲染時重新啟動
+            print(f"警告：渲染超過 {RENDER_TIMEOUT} 秒仍未完成，重新啟動 Manim worker。")
+            _render_worker = None
+            conn.close()
+            proc.kill()
+            proc.join()
+            return False, f"TimeoutError: 渲染超過 {RENDER_TIMEOUT} 秒仍未完成（可能有無窮迴圈或動畫過長）。"
+        result = conn.recv()
+    except (EOFError, OSError):
+        print("警告：常駐 Manim worker 異常結束，改用 manim 子程序。")
+        _render_worker = None
+        _render_worker_disabled = True
+        proc.terminate()
         return None
-    return max(matches, key=os.path.getmtime)
+    return result["ok"], result["stderr"]
 
 
 def _render_manim_core(input_data: str) -> tuple[bool, str]:
     """
     單次嘗試渲染動畫的核心函式：
-      - 直接使用 -pql（低畫質預覽）執行一次 manim。
+      - 優先交給常駐的 manim_worker 渲染（manim 只載入一次，自動修復重試時省下啟動時間）；
+      - worker 無法使用時，改用 -p -ql（低畫質預覽）執行一次 manim 子程序。
 
     回傳：
       - success: 是否成功完成渲染
       - stderr: 這次執行過程中的 stderr 文字（方便傳給 LLM）
     """
-    env = os.environ.copy()
-    env["ALGO_USER_INPUT_DATA"] = input_data
-    try:
-        result = subprocess.run(
-            ["manim", "-pql", GENERATED_CODE_PATH, MANIM_CLASS_NAME],
-            capture_output=True,
-            text=True,
-            check=True,
-            env=env,
-        )
-        return True, (result.stderr or "")
-    except subprocess.CalledProcessError as e:
-        return False, (e.stderr or "")
+    _write_input_sidecar(input_data)
+    result = _render_in_worker()
+    if result is not None:
+        return result
+
+    returncode, stderr = _stream_manim(
+        ["manim", *MANIM_LOG_ARGS, *MANIM_PREVIEW_ARGS, "-ql", GENERATED_CODE_PATH, MANIM_CLASS_NAME]
+    )
+    return returncode == 0, stderr
 
 
 def render_animation(input_data: str):
@@ -367,7 +673,7 @@ def render_animation(input_data: str):
     這裡只負責一次渲染與結果顯示。
     """
     print("=" * 50)
-    print("正在使用 Manim 渲染動畫…（優先 -pqm，失敗回退 -pql）")
+    print("正在使用 Manim 渲染動畫…（-p -ql 低畫質預覽）")
     print("這可能需要一點時間，請耐心等候。")
     print("=" * 50)
 
@@ -381,21 +687,7 @@ def render_animation(input_data: str):
         print("-" * 50)
         return
 
-    video = _find_latest_video()
-    if video:
-        abs_path = os.path.abspath(video)
-        print(f"\n動畫已生成，影片檔案位於: {abs_path}")
-        try:
-            if sys.platform == "win32":
-                os.startfile(video)
-            elif sys.platform == "darwin":
-                subprocess.run(["open", video])
-            else:
-                subprocess.run(["xdg-open", video])
-        except Exception:
-            print("\n無法自動開啟影片，請手動開啟檔案。")
-    else:
-        print("找不到輸出影片檔案，請檢查 Manim 輸出目錄。")
+    _show_rendered_video()
 
 
 if __name__ == "__main__":
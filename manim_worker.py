@@ -0,0 +1,76 @@
+"""
+常駐的 Manim 渲染 worker
+
+由 main.py 以 multiprocessing（spawn）啟動，manim 只在 worker 啟動時載入一次；
+之後每次渲染只重新執行生成的場景檔，不必為每次自動修復嘗試重新啟動
+Python 直譯器、重新載入 numpy / cairo / pango。
+
+通訊協定（multiprocessing Pipe）：
+  - 啟動完成後先送出 {"ready": True}；manim 載入失敗則送出 {"ready": False, "error": ...} 並結束
+  - 請求：{"file": "generated_algo_scene.py", "class": "AlgorithmAnimation", "quality": "low_quality"}
+  - 回應：{"ok": True/False, "stderr": 錯誤 traceback（成功時為空字串）}
+  - 收到 None 時結束
+"""
+
+import importlib.util
+import os
+import sys
+import traceback
+
+
+def _load_scene_class(path: str, class_name: str):
+    """每次都重新執行場景檔，確保拿到 LLM 修正後的最新版本。"""
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, class_name)
+
+
+def _render(request: dict) -> dict:
+    """依請求渲染一次；設定與 `manim -v WARNING -p -ql <file> <class>` 相同。"""
+    from manim import tempconfig
+
+    path = request["file"]
+    try:
+        # 先進入 tempconfig 再執行場景檔：場景檔在模組層級修改的 config
+        # 會在離開時一併還原，不會殘留到這個常駐 worker 之後的渲染
+        with tempconfig(
+            {
+                "input_file": path,
+                "quality": request.get("quality", "low_quality"),
+                "preview": request.get("preview", True),
+                "verbosity": "WARNING",
+            }
+        ):
+            scene_class = _load_scene_class(path, request["class"])
+            scene_class().render()
+    except Exception:
+        return {"ok": False, "stderr": traceback.format_exc()}
+    return {"ok": True, "stderr": ""}
+
+
+def serve(conn, cwd: str) -> None:
+    """worker 主迴圈：逐一處理 conn 收到的渲染請求。"""
+    os.chdir(cwd)
+    # 生成的場景檔會 import 同目錄的 base_algorithm_scene / simple_animation_scene
+    if cwd not in sys.path:
+        sys.path.insert(0, cwd)
+
+    try:
+        import manim  # noqa: F401  只在啟動時載入一次
+    except Exception:
+        conn.send({"ready": False, "error": traceback.format_exc()})
+        conn.close()
+        return
+    conn.send({"ready": True})
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        conn.send(_render(request))
+    conn.close()
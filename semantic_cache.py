@@ -0,0 +1,112 @@
+"""
+相似請求的程式碼快取
+
+同一個演算法搭配「結構相同、數值不同」的輸入（例如 Bubble Sort 的 [8, 2, 6, 4] 與 [3, 1, 5, 2]），
+LLM 產生的 Manim 程式碼除了輸入資料字面值以外幾乎相同。
+此模組以 (模板模式, 正規化後的演算法名稱, 輸入資料的結構) 作為鍵，
+儲存「已成功渲染」的程式碼，並將其中的輸入字串字面值（連同引號）替換為 INPUT_SENTINEL；
+之後遇到相同鍵的請求時，把新輸入字串的 repr 填回去，完全略過 LLM。
+
+實際檔案存放在 llm_cache 的快取目錄中。
+canonical_request 另外提供請求正規化，供視覺隱喻快取使用。
+"""
+
+import ast
+from typing import Optional
+
+import llm_cache
+
+# 程式碼中輸入資料字串字面值（含引號）的替代標記
+INPUT_SENTINEL = "__ALGO_INPUT_LITERAL__"
+
+
+def _normalize_name(algorithm_name: str) -> str:
+    """演算法名稱轉小寫並合併空白，使 "Bubble  sort" 與 "bubble sort" 視為相同。"""
+    return " ".join((algorithm_name or "").lower().split())
+
+
+def _shape(value) -> str:
+    """
+    遞迴描述值的結構：序列記錄每個元素的結構，dict 另外記錄鍵，
+    例如 [8, 2] → "list[int,int]"、{'A': ['B']} → "dict{'A':list[str]}"。
+    """
+    if isinstance(value, dict):
+        items = sorted(f"{key!r}:{_shape(item)}" for key, item in value.items())
+        return "dict{" + ",".join(items) + "}"
+    if isinstance(value, (set, frozenset)):
+        return f"{type(value).__name__}[" + ",".join(sorted(_shape(item) for item in value)) + "]"
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[" + ",".join(_shape(item) for item in value) + "]"
+    return type(value).__name__
+
+
+def input_signature(input_data: str) -> Optional[str]:
+    """
+    回傳輸入資料的結構簽章（見 _shape）；dict 的鍵不同（例如不同節點的圖）會得到不同簽章。
+    無法以 ast.literal_eval 解析時回傳 None（不使用快取）。
+    """
+    try:
+        return _shape(ast.literal_eval(input_data))
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return None
+
+
+def canonical_request(algorithm_name: str, input_data: str) -> tuple[str, str]:
+    """
+    回傳正規化後的 (演算法名稱, 輸入資料)，讓只差在大小寫或空白的請求得到相同結果，
+    例如 ("Bubble Sort", "[8,2,6,4]") 與 ("bubble  sort", "[8, 2, 6, 4]")。
+    輸入可用 ast.literal_eval 解析時以 repr 重新輸出，否則只合併空白。
+    """
+    try:
+        data = repr(ast.literal_eval(input_data))
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        data = " ".join((input_data or "").split())
+    return _normalize_name(algorithm_name), data
+
+
+def _make_key(algorithm_name: str, input_data: str, template_mode: str) -> Optional[str]:
+    signature = input_signature(input_data)
+    if signature is None:
+        return None
+    return llm_cache.make_key(
+        "code_template", template_mode, f"{_normalize_name(algorithm_name)}|{signature}"
+    )
+
+
+def lookup(algorithm_name: str, input_data: str, template_mode: str) -> Optional[str]:
+    """尋找相似請求的程式碼，並填入這次的輸入資料；沒有命中則回傳 None。"""
+    # 與 build_prompt 相同，去除前後空白後的輸入才是 LLM 看到的字面值
+    input_data = input_data.strip()
+    key = _make_key(algorithm_name, input_data, template_mode)
+    if key is None:
+        return None
+    template = llm_cache.get(key)
+    if template is None:
+        return None
+    # 以 repr 產生字串字面值，輸入中含有任何引號都能正確跳脫
+    return template.replace(INPUT_SENTINEL, repr(input_data))
+
+
+def store(algorithm_name: str, input_data: str, template_mode: str, code: str) -> None:
+    """
+    儲存成功渲染的程式碼。
+    只替換以引號包住的輸入字串（例如 ast.literal_eval("[8, 2, 6, 4]")），連同引號一起換成
+    INPUT_SENTINEL，避免誤換到程式碼中其他相同的片段；找不到時不儲存。
+    """
+    input_data = input_data.strip()
+    key = _make_key(algorithm_name, input_data, template_mode)
+    if key is None or not input_data:
+        return
+    template = code
+    for literal in (f'"{input_data}"', f"'{input_data}'", repr(input_data)):
+        template = template.replace(literal, INPUT_SENTINEL)
+    if template == code:
+        return
+    llm_cache.put(key, template)
+
+
+def discard(algorithm_name: str, input_data: str, template_mode: str) -> None:
+    """移除相似請求的程式碼快取（例如沿用後仍無法渲染），下次會重新請求 LLM。"""
+    key = _make_key(algorithm_name, input_data.strip(), template_mode)
+    if key is not None:
+        llm_cache.discard(key)
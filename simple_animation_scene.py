@@ -1,6 +1,24 @@
-from manim import *
 import os
 import ast
+import json
+
+import numpy as np
+from manim import (
+    BLUE_E,
+    DOWN,
+    GRAY_B,
+    GREEN,
+    MAROON_B,
+    PI,
+    RED,
+    UP,
+    YELLOW,
+    Mobject,
+    Scene,
+    Text,
+    Triangle,
+    VGroup,
+)
 
 # ===== 共用字型與顏色設定 =====
 DEFAULT_LATIN_FONT = "Consolas"
@@ -12,6 +30,14 @@ SWAP_COLOR = GREEN
 PIVOT_COLOR = RED
 SORTED_COLOR = GRAY_B
 
+# main.py 寫入使用者輸入資料的 sidecar 檔
+INPUT_SIDECAR_PATH = ".algo_input.json"
+
+# 指標尖端與 target 之間的預設距離，以及對應的位移向量（預先算好，避免每次呼叫重新配置）
+POINTER_BUFF = 0.2
+_DIR_BUFF_BOTTOM = DOWN * POINTER_BUFF
+_DIR_BUFF_TOP = UP * POINTER_BUFF
+
 # 統一控制每個步驟的停頓時間（秒）
 STEP_WAIT = 2.0   # 一般步驟暫停時間
 SHORT_WAIT = 0.75  # 短暫停頓
@@ -48,6 +74,9 @@ class SimpleAnimationScene(Scene):
         # 1) 取得輸入資料（預設為空 list，子類別可 override）
         self.input_data = self.get_input_data()
 
+        # 指標座標計算用的暫存向量（子類別的 setup_animation 不必呼叫 super 也能使用）
+        self._scratch = np.empty(3)
+
         # 2) 讓子類別進行初始設定（若需要）
         self.setup_animation()
 
@@ -62,10 +91,22 @@ class SimpleAnimationScene(Scene):
 
     def get_input_data(self):
         """
-        預設從環境變數讀取使用者輸入資料。
+        預設從 main.py 寫入的 INPUT_SIDECAR_PATH 讀取使用者輸入資料；
+        檔案不存在時改讀環境變數 ALGO_USER_INPUT_DATA。
         子類別可 override 以自訂解析邏輯。
         """
-        input_str = os.environ.get("ALGO_USER_INPUT_DATA", "[]")
+        try:
+            with open(INPUT_SIDECAR_PATH, "rb") as f:
+                payload = json.loads(f.read())
+        except (OSError, ValueError):
+            payload = None
+
+        if payload is not None and payload.get("format") == "json":
+            return payload["data"]
+        if payload is not None:
+            input_str = payload.get("data", "[]")
+        else:
+            input_str = os.environ.get("ALGO_USER_INPUT_DATA", "[]")
         try:
             return ast.literal_eval(input_str)
         except (ValueError, SyntaxError):
@@ -123,7 +164,7 @@ class SimpleAnimationScene(Scene):
         pointer_group.pointer_position = position
         return pointer_group
 
-    def _pointer_target_point(self, pointer: VGroup, target: Mobject, buff: float = 0.2) -> np.ndarray:
+    def _pointer_target_point(self, pointer: VGroup, target: Mobject, buff: float = POINTER_BUFF) -> np.ndarray:
         """
         取得將指標尖端對準 target 後，整個指標 VGroup 應該移動到的中心座標。
 
@@ -137,17 +178,20 @@ class SimpleAnimationScene(Scene):
         if position == "bottom":
             anchor_point = target.get_bottom()
             pointer_tip = triangle.get_top()
-            direction = DOWN
+            dir_buff = _DIR_BUFF_BOTTOM if buff == POINTER_BUFF else DOWN * buff
         else:
             anchor_point = target.get_top()
             pointer_tip = triangle.get_bottom()
-            direction = UP
+            dir_buff = _DIR_BUFF_TOP if buff == POINTER_BUFF else UP * buff
 
-        # pointer 的中心與尖端之間的向量，移動時需加回來
-        offset = pointer.get_center() - pointer_tip
-        return anchor_point + direction * buff + offset
+        # anchor + direction * buff + (pointer 中心 - 尖端)，在暫存向量上原地累加
+        scratch = self._scratch
+        np.subtract(anchor_point, pointer_tip, out=scratch)
+        scratch += dir_buff
+        scratch += pointer.get_center()
+        return scratch.copy()
 
-    def _move_pointer_to(self, pointer: VGroup, target: Mobject, buff: float = 0.2):
+    def _move_pointer_to(self, pointer: VGroup, target: Mobject, buff: float = POINTER_BUFF):
         """
         立即把指標移到 target 旁，尖端保持指向 target。
         （若要動畫移動，請使用 `pointer.animate.move_to(self._pointer_target_point(...))`）
@@ -0,0 +1,60 @@
+"""llm_client 程式碼區塊擷取與多模型併發請求的回歸測試。"""
+
+import asyncio
+
+import pytest
+
+import llm_client
+from llm_client import _extract_code_block
+
+SCENE_CODE = "class AlgorithmAnimation(BaseAlgorithmScene):\n    pass"
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # 其他語言的區塊在前：其結尾 ``` 不可被當成新區塊的開頭
+        f"```text\nstep\n```\nCode:\n```python\n{SCENE_CODE}\n```",
+        # 無語言標記的區塊在前：應優先採用 ```python 區塊
+        f"```\npseudo\n```\n```python\n{SCENE_CODE}\n```",
+        f"```bash\npip install manim\n```\n\n```python\n{SCENE_CODE}\n```",
+    ],
+)
+def test_python_block_wins_over_earlier_fences(text):
+    assert _extract_code_block(text) == SCENE_CODE
+
+
+def test_py_block_preferred_over_bare_block():
+    assert _extract_code_block("```\nbare\n```\n```py\nx = 1\n```") == "x = 1"
+
+
+def test_bare_block_used_as_fallback():
+    assert _extract_code_block(f"```\n{SCENE_CODE}\n```") == SCENE_CODE
+
+
+def test_text_without_fence_is_returned_stripped():
+    assert _extract_code_block(f"  {SCENE_CODE}\n") == SCENE_CODE
+
+
+def test_first_valid_code_does_not_wait_for_slow_models(monkeypatch):
+    delays = {"fast-invalid": 0, "fast-valid": 0.01, "slow-valid": 10}
+    cancelled = []
+
+    async def fake_generate(prompt, model_name):
+        try:
+            await asyncio.sleep(delays[model_name])
+        except asyncio.CancelledError:
+            cancelled.append(model_name)
+            raise
+        return "print('no scene')" if model_name == "fast-invalid" else f"{SCENE_CODE}  # {model_name}"
+
+    monkeypatch.setattr(llm_client, "API_KEY", "test-key")
+    monkeypatch.setattr(llm_client, "_generate_manim_code_async", fake_generate)
+
+    async def run():
+        code = await llm_client.generate_first_valid_manim_code("prompt", list(delays))
+        await asyncio.sleep(0)  # 讓被取消的工作處理 CancelledError
+        return code
+
+    assert asyncio.run(asyncio.wait_for(run(), timeout=5)).endswith("# fast-valid")
+    assert cancelled == ["slow-valid"]
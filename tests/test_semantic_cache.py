@@ -0,0 +1,65 @@
+"""semantic_cache 輸入字面值替換的回歸測試。"""
+
+import ast
+
+import pytest
+
+import llm_cache
+import semantic_cache
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_DIR", str(tmp_path))
+
+
+def _input_literal(code: str):
+    """取出 data = ast.literal_eval(...) 那一行實際解析到的值。"""
+    call = ast.parse(code).body[0].value
+    return ast.literal_eval(ast.literal_eval(call.args[0]))
+
+
+@pytest.mark.parametrize(
+    "stored_input, new_input",
+    [
+        ("['a', 'b']", '["c", "d"]'),
+        ('["a", "b"]', "['c', 'd']"),
+        ("[8, 2, 6, 4]", "[3, 1, 5, 2]"),
+    ],
+)
+def test_lookup_fills_new_input_regardless_of_quotes(stored_input, new_input):
+    for quote in ('"', "'"):
+        if quote in stored_input:
+            continue
+        code = f"data = ast.literal_eval({quote}{stored_input}{quote})\nclass AlgorithmAnimation: pass\n"
+        semantic_cache.store("Sort", stored_input, "full", code)
+        cached = semantic_cache.lookup("Sort", new_input, "full")
+        assert _input_literal(cached) == ast.literal_eval(new_input)
+
+
+def test_store_skips_code_without_quoted_input():
+    semantic_cache.store("Sort", "[1, 2]", "full", "data = [1, 2]\n")
+    assert semantic_cache.lookup("Sort", "[3, 4]", "full") is None
+
+
+def test_discard_removes_stored_template():
+    code = 'data = ast.literal_eval("[1, 2]")\n'
+    semantic_cache.store("Sort", "[1, 2]", "full", code)
+    semantic_cache.discard("Sort", "[3, 4]", "full")
+    assert semantic_cache.lookup("Sort", "[1, 2]", "full") is None
+
+
+def test_store_strips_input_like_build_prompt():
+    code = 'data = ast.literal_eval("[8, 2, 6, 4]")\n'
+    semantic_cache.store("Sort", "[8, 2, 6, 4] ", "full", code)
+    cached = semantic_cache.lookup("Sort", " [3, 1, 5, 2]", "full")
+    assert _input_literal(cached) == [3, 1, 5, 2]
+
+
+def test_signature_tells_graph_shapes_apart():
+    first = "{'A': ['B', 'C'], 'B': []}"
+    other = "{'X': ['Y'], 'Y': ['X']}"
+    assert semantic_cache.input_signature(first) != semantic_cache.input_signature(other)
+    semantic_cache.store("BFS", first, "full", f'data = ast.literal_eval("{first}")\n')
+    assert semantic_cache.lookup("BFS", other, "full") is None
+    assert semantic_cache.lookup("BFS", "{'A': ['C', 'B'], 'B': []}", "full") is not None
@@ -4,25 +4,75 @@
 此模組負責將抽象的演算法概念轉換為具體的視覺設計決策。
 """
 
-import os
+import asyncio
+import hashlib
 import json
-import re
-from dataclasses import dataclass, asdict
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 
-import google.generativeai as genai
-from dotenv import load_dotenv
+from google.api_core.exceptions import GoogleAPIError, ResourceExhausted, ServiceUnavailable
+from google.generativeai.types import BlockedPromptException, StopCandidateException
 
-# 載入環境變數
-load_dotenv()
+import llm_cache
+import semantic_cache
+# API 金鑰、模型設定與模板讀取快取與程式碼生成共用
+from llm_client import API_KEY, get_model, read_prompt_file
 
-API_KEY = os.getenv("GOOGLE_API_KEY")
+# orjson 為選用套件：有安裝時以 C 實作序列化，否則使用標準庫 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 模板的 {{algorithm_name}} / {{input_data}} 放在檔案最後：之前的內容每次請求都逐位元組相同，
+# 可被 Gemini 的隱式前綴快取重用，只有結尾的兩行需要重新處理
 VISUAL_METAPHOR_PROMPT_PATH = "visual_metaphor_prompt.txt"
 
 
-@dataclass
+def _json_loads(text: str):
+    """解析 JSON 字串；有 orjson 時使用 orjson。"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _json_dumps(value) -> str:
+    """輸出精簡的 JSON 字串（保留非 ASCII 字元）；有 orjson 時使用 orjson。"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False)
+
+
+# VisualMetaphor 的欄位（LLM 回傳的 JSON 必須全部包含）與缺少時使用的空值工廠；順序與 dataclass 欄位相同
+_FIELD_DEFAULTS = {
+    "algorithm_name": str,
+    "shapes": dict,
+    "colors": dict,
+    "camera_movements": list,
+    "layout_strategy": str,
+    "animation_style": str,
+    "metaphor_explanation": str,
+}
+
+# 視覺隱喻提示詞模板中的 {{placeholder}} 欄位
+_TEMPLATE_FIELDS = ("algorithm_name", "input_data")
+
+# 解析 LLM 回應用的 JSON 解碼器（raw_decode 可回報解析到的位置）
+_JSON_DECODER = json.JSONDecoder()
+
+
+
+@dataclass(slots=True, frozen=True)
 class VisualMetaphor:
-    """視覺隱喻資料結構"""
+    """
+    視覺隱喻資料結構
+
+    建立後不可再修改欄位（shapes / colors / camera_movements 本身仍是可變容器，
+    唯讀只限於欄位指派）；使用 __slots__，不為每個實例配置 __dict__。
+    """
     algorithm_name: str
     shapes: dict[str, str]
     colors: dict[str, str]
@@ -31,62 +81,85 @@ class VisualMetaphor:
     animation_style: str
     metaphor_explanation: str
 
-    def to_json(self, indent: int = 2) -> str:
-        """轉換為格式化的 JSON 字串"""
-        return json.dumps(asdict(self), ensure_ascii=False, indent=indent)
+    def to_json(self, indent: int = 2, sort_keys: bool = False) -> str:
+        """轉換為格式化的 JSON 字串；sort_keys=True 時輸出固定的鍵順序"""
+        # 直接取欄位組成 dict（不像 asdict 會先深層複製 shapes / colors / camera_movements）
+        data = {name: getattr(self, name) for name in _FIELD_DEFAULTS}
+        # orjson 只支援 2 格縮排，其輸出與 json.dumps(ensure_ascii=False, indent=2) 相同
+        if orjson is not None and indent == 2:
+            option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+            return orjson.dumps(data, option=option).decode("utf-8")
+        return json.dumps(data, ensure_ascii=False, indent=indent, sort_keys=sort_keys)
 
     @classmethod
     def from_dict(cls, data: dict) -> "VisualMetaphor":
-        """從字典建立 VisualMetaphor 物件"""
-        return cls(
-            algorithm_name=data.get("algorithm_name", ""),
-            shapes=data.get("shapes", {}),
-            colors=data.get("colors", {}),
-            camera_movements=data.get("camera_movements", []),
-            layout_strategy=data.get("layout_strategy", ""),
-            animation_style=data.get("animation_style", ""),
-            metaphor_explanation=data.get("metaphor_explanation", "")
-        )
+        """從字典建立 VisualMetaphor 物件；缺少的欄位以該型別的空值補上"""
+        return cls(**{
+            name: data[name] if name in data else empty()
+            for name, empty in _FIELD_DEFAULTS.items()
+        })
+
+
+def _find_fenced_block(text: str, fence: str) -> Optional[str]:
+    """以 str.find 找出第一個以 fence（例如 "```json"）開頭的程式碼區塊內容；找不到則回傳 None。"""
+    start = text.find(fence)
+    while start != -1:
+        line_end = text.find("\n", start + len(fence))
+        if line_end == -1:
+            return None
+        # fence 後方到換行之間只能有空白（排除 ```python 之類的其他語言標記）
+        if not text[start + len(fence):line_end].strip():
+            end = text.find("\n```", line_end)
+            if end == -1:
+                return None
+            return text[line_end + 1:end].strip()
+        start = text.find(fence, start + len(fence))
+    return None
 
 
 def _extract_json_from_response(text: str) -> Optional[dict]:
     """
     從 LLM 回應中提取 JSON 物件。
-    支援 ```json 標記或直接的 JSON 文字。
+    支援 ```json 標記或直接的 JSON 文字；JSON 後方若接著說明文字也能解析。
     """
     if not text:
         return None
 
-    # 嘗試提取 ```json 程式碼區塊
-    json_pattern = r"```json\s*\n([\s\S]*?)\n```"
-    match = re.search(json_pattern, text, flags=re.MULTILINE)
-    
-    if match:
-        json_str = match.group(1).strip()
-    else:
-        # 嘗試提取 ``` 程式碼區塊
-        code_pattern = r"```\s*\n([\s\S]*?)\n```"
-        match = re.search(code_pattern, text, flags=re.MULTILINE)
-        if match:
-            json_str = match.group(1).strip()
-        else:
-            # 假設整段文字就是 JSON
-            json_str = text.strip()
-
-    # 嘗試解析 JSON
+    text = text.strip()
+    if not text.startswith(("{", "[")):
+        # 嘗試提取 ```json 程式碼區塊，其次是 ``` 程式碼區塊；都沒有時從整段文字中尋找 JSON
+        fenced = _find_fenced_block(text, "```json")
+        if fenced is None:
+            fenced = _find_fenced_block(text, "```")
+        if fenced is not None:
+            text = fenced
+
+    # 從第一個 { 或 [ 開始解析，raw_decode 解析完一個完整的值就停下，忽略後方多餘的文字
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        print("JSON 解析失敗: 回應中找不到 JSON 物件")
+        print(f"嘗試解析的內容:\n{text[:500]}...")
+        return None
+    start = min(starts)
+    if start == 0 and orjson is not None:
+        # 常見情況：整段文字就是 JSON，先交給 orjson；後方接著說明文字時才改用 raw_decode
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
     try:
-        return json.loads(json_str)
+        value, _ = _JSON_DECODER.raw_decode(text, start)
+        return value
     except json.JSONDecodeError as e:
         print(f"JSON 解析失敗: {e}")
-        print(f"嘗試解析的內容:\n{json_str[:500]}...")
+        print(f"嘗試解析的內容:\n{text[:500]}...")
         return None
 
 
 def _load_prompt_template() -> Optional[str]:
-    """載入視覺隱喻提示詞模板"""
+    """載入視覺隱喻提示詞模板；檔案未變動時直接回傳快取內容"""
     try:
-        with open(VISUAL_METAPHOR_PROMPT_PATH, "r", encoding="utf-8") as f:
-            return f.read()
+        return read_prompt_file(VISUAL_METAPHOR_PROMPT_PATH)
     except FileNotFoundError:
         print(f"錯誤：找不到視覺隱喻提示詞模板：{VISUAL_METAPHOR_PROMPT_PATH}")
         return None
@@ -95,17 +168,183 @@ def _load_prompt_template() -> Optional[str]:
         return None
 
 
+@lru_cache(maxsize=1)
+def _split_template(template: str) -> tuple[str, ...]:
+    """
+    將模板依 {{algorithm_name}} / {{input_data}} 切開，回傳「文字, 欄位名稱, 文字, ..., 文字」。
+    只在模板內容改變時重新切分；佔位符的順序與次數不限。
+    """
+    pieces = []
+    pos = 0
+    while True:
+        found = [
+            (index, name)
+            for name in _TEMPLATE_FIELDS
+            if (index := template.find(f"{{{{{name}}}}}", pos)) != -1
+        ]
+        if not found:
+            break
+        index, name = min(found)
+        pieces.append(template[pos:index])
+        pieces.append(name)
+        pos = index + len(name) + 4
+    pieces.append(template[pos:])
+    return tuple(pieces)
+
+
 def _build_visual_metaphor_prompt(algorithm_name: str, input_data: str) -> Optional[str]:
-    """建立完整的視覺隱喻生成提示詞"""
+    """建立完整的視覺隱喻生成提示詞（以預先切好的模板片段串接，不必掃描整份模板）"""
     template = _load_prompt_template()
     if template is None:
         return None
 
-    return (
-        template
-        .replace("{{algorithm_name}}", algorithm_name)
-        .replace("{{input_data}}", input_data)
-    )
+    values = {"algorithm_name": algorithm_name, "input_data": input_data}
+    pieces = _split_template(template)
+    # 偶數位置是模板文字，奇數位置是欄位名稱
+    return "".join(values[p] if i % 2 else p for i, p in enumerate(pieces))
+
+
+@lru_cache(maxsize=1)
+def _template_digest(template: str) -> str:
+    """模板內容的 SHA-256；只在模板改變時重新計算。"""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()
+
+
+def _metaphor_cache_key(algorithm_name: str, input_data: str, model_name: str) -> str:
+    """
+    以 (模板摘要, 正規化後的請求) 作為快取鍵；模板內容改變時鍵也會跟著改變。
+    不必為了算快取鍵再組出一份完整的提示詞。
+    """
+    name, data = semantic_cache.canonical_request(algorithm_name, input_data)
+    template_digest = _template_digest(_load_prompt_template() or "")
+    return llm_cache.make_key("metaphor", model_name, f"{template_digest}\0{name}\0{data}")
+
+
+# 視覺隱喻回應的輸出 token 上限。設計 JSON 本身約數百 token，
+# 但 gemini-3 系列的思考 token 也計入此上限，因此保留足夠空間，只用來截斷失控的長篇輸出
+METAPHOR_MAX_OUTPUT_TOKENS = 8192
+
+# 遇到速率限制 / 服務暫時無法使用時的最多嘗試次數與最長等待秒數
+METAPHOR_MAX_ATTEMPTS = 5
+METAPHOR_RETRY_MAX_DELAY = 8
+
+# 可重試的暫時性 API 錯誤（429 / 503）
+_TRANSIENT_API_ERRORS = (ResourceExhausted, ServiceUnavailable)
+
+# 呼叫 API 時預期可能發生、只需印出訊息的錯誤：API 錯誤、被安全機制擋下的提示詞或回應
+# （串流迭代時拋出 BlockedPromptException / StopCandidateException，讀取 .text 時為 ValueError）與網路錯誤。
+# 其他例外（程式錯誤）照常拋出
+_API_ERRORS = (
+    GoogleAPIError,
+    BlockedPromptException,
+    StopCandidateException,
+    ValueError,
+    OSError,
+)
+
+# 生成視覺隱喻時的取樣設定（稍微提高創意性）；要求模型直接輸出 JSON，不包 ``` 也不加說明文字
+_GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "max_output_tokens": METAPHOR_MAX_OUTPUT_TOKENS,
+    "response_mime_type": "application/json",
+}
+
+
+def _prepare_request(
+    algorithm_name: str, input_data: str, model_name: str
+) -> Optional[tuple[str, str]]:
+    """檢查 API 金鑰並建立 (提示詞, 快取鍵)；任何一步失敗時回傳 None。"""
+    if not API_KEY:
+        print("錯誤：找不到 GOOGLE_API_KEY。")
+        print("請在專案根目錄建立 .env 檔案並設定 GOOGLE_API_KEY=你的金鑰。")
+        return None
+
+    # 建立提示詞
+    prompt = _build_visual_metaphor_prompt(algorithm_name, input_data)
+    if prompt is None:
+        return None
+
+    # 快取鍵以正規化後的演算法名稱與輸入資料建立，只差在大小寫或空白的請求共用同一份設計
+    return prompt, _metaphor_cache_key(algorithm_name, input_data, model_name)
+
+
+def _load_cached_metaphor(cache_key: str, model_name: str) -> Optional[VisualMetaphor]:
+    """相同模型 + 相同請求曾成功生成過：直接讀取快取，不呼叫 API。"""
+    cached = llm_cache.get(cache_key)
+    if cached is None:
+        return None
+    try:
+        visual_metaphor = VisualMetaphor.from_dict(_json_loads(cached))
+    except ValueError:
+        # 快取內容損毀時當作未命中，重新生成後覆寫
+        return None
+    print(f"使用快取的視覺隱喻設計 (Model: {model_name})")
+    return visual_metaphor
+
+
+def _json_object_complete(buffer: str) -> bool:
+    """串流中的文字是否已包含一個完整的 JSON 物件（從第一個 { 起算）。"""
+    start = buffer.find("{")
+    if start == -1:
+        return False
+    try:
+        _JSON_DECODER.raw_decode(buffer, start)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def _append_chunk(chunks: list[str], chunk) -> bool:
+    """加入一段串流回應；JSON 物件已完整時回傳 True，呼叫端即可停止接收後續的說明文字。"""
+    text = getattr(chunk, "text", None) or ""
+    chunks.append(text)
+    # 只有在收到可能結束物件的 } 時才嘗試解析，避免每段都重新掃描整個緩衝區
+    return "}" in text and _json_object_complete("".join(chunks))
+
+
+async def _collect_stream_async(response) -> str:
+    """逐段接收串流回應，JSON 物件一完整就停止。"""
+    chunks = []
+    async for chunk in response:
+        if _append_chunk(chunks, chunk):
+            break
+    return "".join(chunks)
+
+
+def _parse_response(content_text: str, cache_key: str) -> Optional[VisualMetaphor]:
+    """從 LLM 回應文字解析並驗證視覺隱喻；通過驗證的結果才寫入快取。"""
+    # 解析 JSON
+    json_data = _extract_json_from_response(content_text)
+    if json_data is None:
+        print("錯誤：無法從 LLM 回應中提取有效的 JSON。")
+        return None
+
+    # 驗證必要欄位並建立 VisualMetaphor 物件
+    visual_metaphor = _finalize(json_data)
+    if visual_metaphor is None:
+        return None
+    llm_cache.put(cache_key, _json_dumps(json_data))
+    return visual_metaphor
+
+
+def _finalize(json_data: dict) -> Optional[VisualMetaphor]:
+    """依欄位順序走訪一次 json_data：同時檢查必要欄位並收集建構參數；有缺少欄位時回傳 None。"""
+    values = []
+    missing_fields = []
+    for name in _FIELD_DEFAULTS:
+        if name in json_data:
+            values.append(json_data[name])
+        else:
+            missing_fields.append(name)
+    if missing_fields:
+        print(f"錯誤：JSON 缺少必要欄位：{', '.join(missing_fields)}")
+        return None
+    return VisualMetaphor(*values)
+
+
+def _retry_delay(attempt: int) -> float:
+    """第 attempt 次重試前的等待秒數：指數退避加上少許隨機抖動，上限 METAPHOR_RETRY_MAX_DELAY。"""
+    return min(2 ** attempt * 0.5 + random.random() * 0.1, METAPHOR_RETRY_MAX_DELAY)
 
 
 def generate_visual_metaphor(
@@ -124,66 +363,101 @@ def generate_visual_metaphor(
     回傳:
         VisualMetaphor 物件，若失敗則回傳 None
     """
-    if not API_KEY:
-        print("錯誤：找不到 GOOGLE_API_KEY。")
-        print("請在專案根目錄建立 .env 檔案並設定 GOOGLE_API_KEY=你的金鑰。")
-        return None
+    # 與批次生成共用同一份非同步實作（重試、串流與錯誤處理只維護一處）
+    return asyncio.run(generate_visual_metaphor_async(algorithm_name, input_data, model_name))
 
-    # 建立提示詞
-    prompt = _build_visual_metaphor_prompt(algorithm_name, input_data)
-    if prompt is None:
+
+async def generate_visual_metaphor_async(
+    algorithm_name: str,
+    input_data: str,
+    model_name: str = "gemini-3-pro-preview"
+) -> Optional[VisualMetaphor]:
+    """
+    generate_visual_metaphor 的非同步版本，供 generate_visual_metaphors_batch 併發呼叫；
+    同步版本也是以 asyncio.run 執行這個函式。
+    """
+    request = _prepare_request(algorithm_name, input_data, model_name)
+    if request is None:
         return None
+    prompt, cache_key = request
+
+    cached = _load_cached_metaphor(cache_key, model_name)
+    if cached is not None:
+        return cached
 
     try:
-        # 呼叫 LLM API
-        genai.configure(api_key=API_KEY)
-        model = genai.GenerativeModel(model_name)
-        
-        print(f"正在使用 {model_name} 生成視覺隱喻設計...")
-        response = model.generate_content(
-            prompt,
-            generation_config={"temperature": 0.3}  # 稍微提高創意性
-        )
-
-        # 提取回應文字
-        content_text = getattr(response, "text", None) or ""
-        
-        # 解析 JSON
-        json_data = _extract_json_from_response(content_text)
-        if json_data is None:
-            print("錯誤：無法從 LLM 回應中提取有效的 JSON。")
-            return None
+        model = get_model(model_name)
+
+        print(f"正在使用 {model_name} 生成視覺隱喻設計：{algorithm_name}...")
+        for attempt in range(METAPHOR_MAX_ATTEMPTS):
+            try:
+                response = await model.generate_content_async(
+                    prompt, generation_config=_GENERATION_CONFIG, stream=True
+                )
+                content_text = await _collect_stream_async(response)
+                break
+            except _TRANSIENT_API_ERRORS as e:
+                if attempt == METAPHOR_MAX_ATTEMPTS - 1:
+                    raise
+                delay = _retry_delay(attempt)
+                print(f"API 暫時無法使用（{algorithm_name}：{e}），{delay:.1f} 秒後重試...")
+                await asyncio.sleep(delay)
+        return _parse_response(content_text, cache_key)
+
+    except _API_ERRORS as e:
+        print(f"生成視覺隱喻時發生錯誤（{algorithm_name}）：{e}")
+        return None
 
-        # 驗證必要欄位
-        required_fields = [
-            "algorithm_name", "shapes", "colors", 
-            "camera_movements", "layout_strategy", 
-            "animation_style", "metaphor_explanation"
-        ]
-        missing_fields = [f for f in required_fields if f not in json_data]
-        if missing_fields:
-            print(f"錯誤：JSON 缺少必要欄位：{', '.join(missing_fields)}")
-            return None
 
-        # 建立 VisualMetaphor 物件
-        visual_metaphor = VisualMetaphor.from_dict(json_data)
-        return visual_metaphor
+async def generate_visual_metaphors_batch(
+    items: list[tuple[str, str]],
+    model_name: str = "gemini-3-pro-preview",
+    concurrency: int = 8,
+) -> list[Optional[VisualMetaphor]]:
+    """
+    併發生成多個演算法的視覺隱喻設計，總耗時約等於最慢的幾次呼叫，而非全部相加。
 
-    except Exception as e:
-        print(f"生成視覺隱喻時發生錯誤：{e}")
-        return None
+    參數:
+        items: (演算法名稱, 輸入資料) 列表
+        model_name: LLM 模型名稱
+        concurrency: 同時進行的請求上限，避免超過 API 速率限制
+
+    回傳:
+        與 items 順序相同的 VisualMetaphor 列表；失敗的項目為 None
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run_one(algorithm_name: str, input_data: str) -> Optional[VisualMetaphor]:
+        async with semaphore:
+            return await generate_visual_metaphor_async(algorithm_name, input_data, model_name)
+
+    return list(await asyncio.gather(*(_run_one(name, data) for name, data in items)))
+
+
+def _warm_up(model_name: str = "gemini-3-pro-preview") -> None:
+    """預先載入並切分模板、建立模型，讓使用者輸入完成時只剩下 API 呼叫。"""
+    template = _load_prompt_template()
+    if template is not None:
+        _split_template(template)
+        _template_digest(template)
+    if API_KEY:
+        get_model(model_name)
 
 
 def main():
     """測試用主程式"""
     print("=== 視覺隱喻設計器測試 ===\n")
-    
-    algorithm_name = input("請輸入演算法名稱 (例如: Bubble Sort): ").strip()
-    input_data = input("請輸入要處理的資料 (例如: [8, 2, 6, 4]): ").strip()
 
-    if not algorithm_name or not input_data:
-        print("錯誤：演算法名稱和輸入資料不能為空。")
-        return
+    # 等待使用者輸入的同時，在背景準備模板與模型（離開 with 時會等待準備完成）
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(_warm_up)
+
+        algorithm_name = input("請輸入演算法名稱 (例如: Bubble Sort): ").strip()
+        input_data = input("請輸入要處理的資料 (例如: [8, 2, 6, 4]): ").strip()
+
+        if not algorithm_name or not input_data:
+            print("錯誤：演算法名稱和輸入資料不能為空。")
+            return
 
     print("\n" + "=" * 50)
     visual_metaphor = generate_visual_metaphor(algorithm_name, input_data)